@@ -1,6 +1,8 @@
 import pandas as pd
 import random
+from collections import Counter
 from tqdm import tqdm
+from knowledge_base import load_knowledge_base
 
 # --- 1. CONFIGURATION ---
 
@@ -15,379 +17,82 @@ OUTPUT_DATASET_PATH = 'finetuning_dataset.csv'
 # Number of varied text queries to generate for each image
 QUERIES_PER_IMAGE = 8
 
+# Queries built directly around the dish name, added for every image
+DIRECT_QUERY_PATTERNS = [
+    "I want to eat {dish_name}.",
+    "Show me pictures of {dish_name}.",
+]
+
+# --- BALANCED SAMPLING ---
+# Set to True to run generate_balanced_dataset() instead of generate_final_dataset()
+USE_BALANCED_SAMPLING = False
+# Output: A dataset with balanced tag and template frequencies
+BALANCED_OUTPUT_DATASET_PATH = 'finetuning_dataset_balanced.csv'
+# Output: The realized per-tag distribution of the balanced dataset
+BALANCED_REPORT_PATH = 'finetuning_dataset_balanced_report.csv'
+# Rows to keep for each tag, split evenly across that tag's templates
+SAMPLES_PER_TAG = 16_000
+# Rows to keep for each of the DIRECT_QUERY_PATTERNS
+SAMPLES_PER_DIRECT_PATTERN = 50_000
+
+# --- QUERY VOCABULARY (pre-tokenized text for the SigLIP text tower) ---
+# Set to True to also write the query vocabulary and a tokenized copy of the dataset
+EMIT_QUERY_VOCABULARY = False
+# Output: Every unique query template / direct pattern, tokenized once
+QUERY_VOCABULARY_PATH = 'query_vocabulary.parquet'
+# Output: One row per sample with a query id instead of the query text
+TOKENIZED_DATASET_PATH = 'finetuning_dataset_tokenized.parquet'
+# Default tokenizer (needs `transformers`); pass `tokenize=` to the generators to plug in another
+TOKENIZER_NAME = 'google/siglip-base-patch16-224'
+
 
 # --- 2. QUERY TEMPLATES ---
-# The script will use these templates. The keys MUST match your tags.
-TAG_TO_TEMPLATES = {
-    # --- Dietary ---
-    'vegetarian': [
-        "Show me some vegetarian options.",
-        "I'm looking for a good veggie dish.",
-        "What vegetarian food do you have?",
-        "What are the non-meat options?",
-        "I'm purely vegetarian."
-    ],
-    'non_vegetarian': [
-        "What are your non-veg specialties?",
-        "I'm in the mood for chicken or meat.",
-        "Show me the non-vegetarian menu.",
-        "What meat dishes do you have?",
-        "I'm not vegetarian, what do you recommend?"
-    ],
-    'healthy': [
-        "I need a light and healthy meal.",
-        "What's a nutritious option?",
-        "Show me your healthy choices.",
-        "Suggest something healthy but tasty.",
-        "What's a good guilt-free option?"
-    ],
-    'light_meal': [
-        "I want something light, not too heavy.",
-        "Suggest a light meal.",
-        "Looking for a small, light dish.",
-        "I'm not very hungry, just something light.",
-        "What are some of your lighter options?"
-    ],
-
-    # --- Meal Type ---
-    'main_course': [
-        "I'm looking for a main course.",
-        "What's a good idea for dinner?",
-        "Suggest a filling main dish.",
-        "I'm ready for the main event.",
-        "What's a good entree?"
-    ],
-    'breakfast': [
-        "What's a good breakfast option?",
-        "Suggest a light and healthy breakfast.",
-        "What do you have for breakfast?",
-        "What's on the breakfast menu?",
-        "I'd like to order breakfast."
-    ],
-    'snack': [
-        "What's a good evening snack?",
-        "I need a light bite.",
-        "Suggest a quick snack.",
-        "I'm feeling a bit hungry, need a snack.",
-        "Just a small bite to eat."
-    ],
-    'dessert': [
-        "I have a massive sweet tooth right now.",
-        "What's for dessert?",
-        "Show me the dessert menu.",
-        "Craving something sweet.",
-        "I'm ready for something sweet."
-    ],
-    'beverage': [
-        "I'm thirsty, what drinks do you have?",
-        "Can I get a beverage?",
-        "What's good to drink?",
-        "What are the drink options?",
-        "Can I see the beverage list?"
-    ],
-    'appetizer': [
-        "What are some good appetizers?",
-        "Let's start with an appetizer.",
-        "Show me the starters.",
-        "What should we get for a starter?",
-        "Let's get something to share before the main."
-    ],
-
-    # --- Cuisine / Style ---
-    'north_indian': [
-        "I'm in the mood for North Indian food.",
-        "What North Indian dishes do you recommend?",
-        "Craving North Indian curry.",
-        "Do you have any tandoori food?",
-        "Show me the North Indian specialties."
-    ],
-    'south_indian': [
-        "I feel like having South Indian food.",
-        "Show me your South Indian specialties.",
-        "I'd like a dosa or idli.",
-        "What's on the South Indian menu?",
-        "I want something light like South Indian food."
-    ],
-    'punjabi': [
-        "Do you have any Punjabi dishes?",
-        "I want some rich Punjabi food.",
-        "I want some rich, buttery Punjabi food.",
-        "What's your best Punjabi curry?",
-        "Craving some chole or rajma."
-    ],
-    'indian_cuisine': [
-        "I'm looking for Indian food.",
-        "What's your most popular Indian dish?",
-        "What's your house special Indian dish?",
-        "I'm in the mood for some desi food.",
-        "Do you have classic Indian curries?"
-    ],
-    'chinese_cuisine': [
-        "I'm craving Chinese food.",
-        "What Chinese dishes do you have?",
-        "Feel like having some Indo-Chinese.",
-        "I feel like some noodles or fried rice.",
-        "What's on the Chinese menu?"
-    ],
-    'japanese_cuisine': [
-        "Do you have any Japanese food?",
-        "I'd like to try some Japanese cuisine.",
-        "I'm in the mood for sushi.",
-        "Do you have ramen or teriyaki?",
-        "Show me the Japanese options."
-    ],
-    'asian_cuisine': [
-        "What kind of Asian food do you serve?",
-        "I'm in the mood for something Asian.",
-        "Looking for Thai, Chinese, or Japanese.",
-        "What's a good pan-Asian dish?",
-        "I want something with Asian flavors."
-    ],
-    'western_cuisine': [
-        "I'm looking for some Western food.",
-        "What's on the continental menu?",
-        "I want a burger or pasta.",
-        "I'm not in the mood for Indian, what else do you have?",
-        "I'll have a sandwich or a burger."
-    ],
-    'street_food': [
-        "I feel like eating some street food.",
-        "Suggest a popular street food item.",
-        "Craving some chaat or something.",
-        "I want something quick and chatpata.",
-        "What's your best street-style dish?"
-    ],
-
-    # --- Flavor / Texture ---
-    'creamy': [
-        "I want something rich and creamy.",
-        "What's your creamiest dish?",
-        "Suggest a dish with a rich, creamy gravy.",
-        "I want a malai or korma dish.",
-        "What's something creamy and comforting?"
-    ],
-    'savory': [
-        "I'm in the mood for something savory.",
-        "Not sweet, I want a savory dish.",
-        "I want a savory main course.",
-        "Something salty and savory, not sweet.",
-        "What's your best savory snack?"
-    ],
-    'rich': [
-        "I want something rich and decadent.",
-        "Suggest a heavy, rich meal.",
-        "I'm celebrating, give me something rich.",
-        "Looking for a heavy, decadent meal.",
-        "What's a rich, Mughlai-style dish?"
-    ],
-    'sweet': [
-        "I have a sweet tooth.",
-        "Show me something sweet.",
-        "I'm craving sugar.",
-        "What's your most popular sweet dish?",
-        "I need a sweet treat."
-    ],
-    'spicy': [
-        "I'm craving something hot and spicy.",
-        "What's the spiciest dish you have?",
-        "Make it spicy.",
-        "I want something really hot, extra spicy.",
-        "What's a fiery dish I can try?"
-    ],
-    'tangy': [
-        "I want something tangy and chatpata.",
-        "What's a good tangy dish?",
-        "I want a chaat-style tangy dish.",
-        "Something with a sour and tangy flavor.",
-        "Give me something with tamarind or lemon."
-    ],
-    'raw': [
-        "Do you have any raw options, like sashimi?",
-        "I'm looking for something raw and fresh.",
-        "I'm looking for a fresh, uncooked dish.",
-        "What salads or raw fish do you have?",
-        "A simple raw appetizer would be great."
-    ],
-
-    # --- Cooking Method ---
-    'fried': [
-        "I'm craving something fried and crunchy.",
-        "What's a popular deep-fried dish?",
-        "Suggest a crispy snack.",
-        "I want some deep-fried goodness.",
-        "What's your crispiest dish?"
-    ],
-    'grilled': [
-        "I want something grilled.",
-        "What's healthy and grilled?",
-        "Show me the grilled options.",
-        "What's on the grill today?",
-        "I'd like a grilled appetizer."
-    ],
-    'baked': [
-        "Do you have any baked goods?",
-        "I'm looking for something baked, not fried.",
-        "Do you have any baked snacks?",
-        "I'm looking for a baked dessert.",
-        "Show me the items from the oven."
-    ],
-    'steamed': [
-        "I want a light, steamed dish.",
-        "What are your steamed options?",
-        "Suggest something healthy and steamed.",
-        "I'm on a diet, what's steamed?",
-        "I'd like some steamed dumplings."
-    ],
-    'curry': [
-        "I feel like a good curry.",
-        "What's your best curry?",
-        "Show me the list of curries.",
-        "Suggest a good curry.",
-        "What curries go well with naan?"
-    ],
-    'tandoori': [
-        "I want something from the tandoor.",
-        "What are your tandoori specialties?",
-        "What's fresh from the tandoor?",
-        "I'd like a tandoori platter.",
-        "Show me the tandoori breads and appetizers."
-    ],
-    'stew': [
-        "I want a hearty stew.",
-        "Do you have any slow-cooked stews?",
-        "What's a good slow-cooked meal?",
-        "I want a hearty stew for this cold weather.",
-        "Do you have any stews or casseroles?"
-    ],
-
-    # --- Key Ingredient / Dish Type ---
-    'bread': [
-        "What types of bread do you have?",
-        "Can I get some bread with this?",
-        "What kind of Indian breads do you have?",
-        "I need some bread to go with my curry.",
-        "Can I see the bread basket options?"
-    ],
-    'rice_dish': [
-        "I'm in the mood for a rice dish.",
-        "What are your rice-based meals?",
-        "I want biryani or pulao.",
-        "What are my options for rice?",
-        "I'll have a rice-based main."
-    ],
-    'noodle': [
-        "I want to eat noodles.",
-        "What kind of noodle dishes do you have?",
-        "I'm craving a bowl of noodles.",
-        "What's your best noodle dish?",
-        "Do you have Hakka noodles?"
-    ],
-    'seafood': [
-        "What's your best seafood dish?",
-        "I'm in the mood for fish or shrimp.",
-        "Show me the seafood menu.",
-        "What's the catch of the day?",
-        "I want to eat some fish."
-    ],
-    'beef': [
-        "I'm looking for a beef dish.",
-        "What are your beef options?",
-        "What are your beef curries?",
-        "I'll have a beef steak.",
-        "How is the beef prepared?"
-    ],
-    'pork': [
-        "Do you serve pork?",
-        "What pork dishes do you have?",
-        "What's your most popular pork dish?",
-        "I'm in the mood for pork ribs.",
-        "Do you have any pork-based appetizers?"
-    ],
-    'egg': [
-        "What do you have with eggs?",
-        "I'd like an egg dish for breakfast.",
-        "I'll have an omelette.",
-        "What egg curries do you have?",
-        "What are the egg-based breakfast options?"
-    ],
-    'dumpling': [
-        "I feel like having dumplings.",
-        "What kind of dumplings are on the menu?",
-        "I want momos.",
-        "What's in the dumplings?",
-        "Can I get a plate of steamed dumplings?"
-    ],
-    'sushi': [
-        "I'm craving sushi.",
-        "What are your sushi roll options?",
-        "Show me the sushi menu.",
-        "What are your maki roll options?",
-        "I'd like a sushi platter."
-    ],
-    'sandwich': [
-        "Can I get a sandwich?",
-        "What's a good quick sandwich?",
-        "I just want a simple sandwich.",
-        "What's in the club sandwich?",
-        "Do you have any grilled sandwiches?"
-    ],
-    'platter': [
-        "I'm with a group, do you have any platters?",
-        "What's on the assorted platter?",
-        "What's in the mixed platter?",
-        "We're a group, suggest a good sharing platter.",
-        "I'll get the tandoori platter."
-    ],
-    'fruit': [
-        "I'd like some fresh fruit.",
-        "Do you have a fruit platter or fruit salad?",
-        "What's in the fruit bowl?",
-        "Can I get a side of fresh fruits?",
-        "I'd like a fruit juice, fresh."
-    ],
-
-    # --- Occasion / Feeling ---
-    'comfort_food': [
-        "Long day at work, I need some comfort food.",
-        "Suggest something to cheer me up.",
-        "What's a good, comforting meal?",
-        "I need something hearty and comforting.",
-        "What's a good home-style meal?"
-    ],
-    'celebratory': [
-        "I'm celebrating! Suggest something special.",
-        "What's a good dish for a party?",
-        "We're looking for a festive meal.",
-        "It's my birthday, suggest a special dish.",
-        "We want to order something fancy."
-    ],
-    'quick_and_easy': [
-        "I'm in a hurry, what's quick?",
-        "What's a quick and easy option?",
-        "I need food, fast.",
-        "I'm really hungry, what's the fastest dish?",
-        "I don't have much time, what's ready to go?"
-    ],
-    'rainy_day': [
-        "It's a classic rainy day, what's a good snack?",
-        "Feeling cozy because of the rain, suggest something warm.",
-        "What's the perfect food for this gloomy weather?",
-        "It's raining, I want something hot.",
-        "What's a good snack for this rainy weather?"
-    ],
-    'summer_food': [
-        "It's so hot, I need something cooling.",
-        "What's a good summer dish?",
-        "Suggest something refreshing for this heat.",
-        "It's boiling outside, I need a cold drink.",
-        "What's a good light meal for this summer?"
-    ]
-}
-
-
-def generate_final_dataset():
+# The tag-to-template mapping lives in 'data/tag_to_templates.json'. The keys MUST match your tags.
+# It is compiled into a binary artifact by knowledge_base.py (see load_knowledge_base).
+
+
+def make_template_id_lookup(kb):
     """
-    Generates the final (text, image_url, dish_name) dataset from the tagged dishes.
+    Builds a function mapping a 'tags' string to the tuple of its unique query template ids.
+    Each distinct tag combination is resolved only once.
+    """
+    tag_ids = kb['tag_ids']
+    tag_template_ids = kb['tag_template_ids']
+    cache = {}
+
+    def get_template_ids(tags_string):
+        if tags_string not in cache:
+            template_ids = set()
+            for tag in tags_string.split('|'):
+                if tag in tag_ids:
+                    template_ids.update(tag_template_ids[tag_ids[tag]])
+            cache[tags_string] = tuple(sorted(template_ids))
+        return cache[tags_string]
+
+    return get_template_ids
+
+
+def direct_query_id(kb, pattern_index):
+    """
+    Query ids cover the templates first (0..T-1), then the DIRECT_QUERY_PATTERNS.
+    """
+    return len(kb['templates']) + pattern_index
+
+
+def query_text(kb, query_id, dish_name):
+    """
+    Renders the text of a query id for a given dish.
+    """
+    templates = kb['templates']
+    if query_id < len(templates):
+        return templates[query_id]
+    return DIRECT_QUERY_PATTERNS[query_id - len(templates)].format(dish_name=dish_name)
+
+
+def load_merged_dishes():
+    """
+    Loads the tagged dishes and joins them with the original data to get one row per image.
+    Returns None (after printing the reason) if the inputs are missing or unusable.
     """
     try:
         # Load the tagged dishes
@@ -396,7 +101,7 @@ def generate_final_dataset():
         df_original = pd.read_excel(ORIGINAL_DATA_PATH)
     except FileNotFoundError as e:
         print(f"Error: Could not find a required file. {e}")
-        return
+        return None
     
     # 1. Filter out untagged dishes
     df_tagged = df_tagged.dropna(subset=['tags'])
@@ -414,37 +119,49 @@ def generate_final_dataset():
     if 'image_url' not in df_merged.columns:
         print("Error: 'image_url' column not found in the merged data.")
         print("Please ensure your original data file has 'dish_name' and 'image_url' columns.")
-        return
+        return None
         
     print(f"Found {len(df_merged)} images to process.")
+    return df_merged
+
+
+def generate_final_dataset(tokenize=None):
+    """
+    Generates the final (text, image_url, dish_name) dataset from the tagged dishes.
+    `tokenize` is only used when EMIT_QUERY_VOCABULARY is set (see write_query_vocabulary).
+    """
+    df_merged = load_merged_dishes()
+    if df_merged is None:
+        return
 
     final_data = []
+    kb = load_knowledge_base()
+    get_template_ids = make_template_id_lookup(kb)
+    direct_query_ids = [direct_query_id(kb, i) for i in range(len(DIRECT_QUERY_PATTERNS))]
 
     # 3. Iterate and generate queries
     for _, row in tqdm(df_merged.iterrows(), total=df_merged.shape[0], desc="Generating Text Queries"):
         image_url = row['image_url']
         dish_name = row['dish_name']
-        tags = row['tags'].split('|')
         
+        # Queries are handled as ids (see direct_query_id) and rendered to text at the end
         possible_queries = set()
         
         # Add direct queries
-        possible_queries.add(f"I want to eat {dish_name}.")
-        possible_queries.add(f"Show me pictures of {dish_name}.")
+        possible_queries.update(direct_query_ids)
         
         # Add queries from templates
-        for tag in tags:
-            if tag in TAG_TO_TEMPLATES:
-                possible_queries.update(TAG_TO_TEMPLATES[tag])
+        possible_queries.update(get_template_ids(row['tags']))
         
         # Sample queries
         num_to_sample = min(QUERIES_PER_IMAGE, len(possible_queries))
         if num_to_sample > 0:
             sampled_queries = random.sample(list(possible_queries), num_to_sample)
-            for query in sampled_queries:
+            for query_id in sampled_queries:
                 # --- THIS IS THE MODIFIED LINE ---
                 # Add dish_name to the dictionary
-                final_data.append({'text': query, 'image_url': image_url, 'dish_name': dish_name})
+                final_data.append({'text': query_text(kb, query_id, dish_name), 'image_url': image_url,
+                                   'dish_name': dish_name, 'query_id': query_id})
 
     df_final = pd.DataFrame(final_data)
     
@@ -453,7 +170,7 @@ def generate_final_dataset():
         return
 
     # 4. Save the final dataset
-    df_final.to_csv(OUTPUT_DATASET_PATH, index=False)
+    df_final[['text', 'image_url', 'dish_name']].to_csv(OUTPUT_DATASET_PATH, index=False)
     
     print(f"\nSuccessfully generated {len(df_final)} (text, image_url, dish_name) pairs.")
     print(f"Final training dataset saved to '{OUTPUT_DATASET_PATH}'")
@@ -461,5 +178,220 @@ def generate_final_dataset():
     # Re-order columns for better display in the sample
     print(df_final.sample(5)[['text', 'dish_name', 'image_url']])
 
+    if EMIT_QUERY_VOCABULARY:
+        write_query_vocabulary(df_final, kb, tokenize)
+
+
+# --- 3. BALANCED SAMPLING ---
+
+class Reservoir:
+    """
+    Keeps a uniform random sample of at most `capacity` items from a stream (Algorithm R).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.seen = 0
+        self.items = []
+
+    def offer(self, item):
+        self.seen += 1
+        if len(self.items) < self.capacity:
+            self.items.append(item)
+        else:
+            j = random.randrange(self.seen)
+            if j < self.capacity:
+                self.items[j] = item
+
+
+def template_capacities(kb):
+    """
+    Splits SAMPLES_PER_TAG evenly across each tag's templates, spreading the remainder
+    so each tag's template quotas add up exactly to SAMPLES_PER_TAG.
+    A template shared by several tags gets the largest of their shares.
+    """
+    capacities = [0] * len(kb['templates'])
+    for template_ids in kb['tag_template_ids']:
+        if not template_ids:
+            continue
+        share, remainder = divmod(SAMPLES_PER_TAG, len(template_ids))
+        for position, template_id in enumerate(template_ids):
+            template_share = share + (1 if position < remainder else 0)
+            capacities[template_id] = max(capacities[template_id], template_share)
+    return capacities
+
+
+def realized_distribution(kb, template_reservoirs, direct_reservoirs, tags_string_counts):
+    """
+    Summarizes how many rows each tag and direct pattern received, next to its quota and
+    'candidate_images': the number of distinct images carrying the tag (every image, for a
+    direct pattern). `tags_string_counts` counts the images per 'tags' string.
+    A template shared by several tags is counted in each of them, so per-tag rows can then add up
+    to more than the dataset size. Today's templates are all unique to one tag.
+    """
+    tag_image_counts = Counter()
+    for tags_string, images in tags_string_counts.items():
+        for tag in set(tags_string.split('|')):
+            tag_image_counts[tag] += images
+
+    rows = []
+    for tag_id, tag in enumerate(kb['tags']):
+        template_ids = kb['tag_template_ids'][tag_id]
+        if not template_ids:
+            continue
+        rows.append({
+            'query_source': tag,
+            'sampled': sum(len(template_reservoirs[i].items) for i in template_ids),
+            'quota': sum(template_reservoirs[i].capacity for i in template_ids),
+            'candidate_images': tag_image_counts[tag],
+        })
+    for pattern, reservoir in zip(DIRECT_QUERY_PATTERNS, direct_reservoirs):
+        rows.append({
+            'query_source': pattern,
+            'sampled': len(reservoir.items),
+            'quota': reservoir.capacity,
+            'candidate_images': reservoir.seen,
+        })
+    report = pd.DataFrame(rows)
+    report['fill_rate'] = (report['sampled'] / report['quota']).round(3)
+    return report.sort_values('sampled', ascending=False, ignore_index=True)
+
+
+def generate_balanced_dataset(tokenize=None):
+    """
+    Generates a (text, image_url, dish_name) dataset with balanced tag and template frequencies.
+    Every (image, template) candidate is offered to a per-template reservoir in a single pass,
+    so the sampling state is bounded by the quotas rather than by the number of images.
+    (load_merged_dishes() still loads both workbooks fully.)
+    `tokenize` is only used when EMIT_QUERY_VOCABULARY is set (see write_query_vocabulary).
+    """
+    df_merged = load_merged_dishes()
+    if df_merged is None:
+        return
+
+    kb = load_knowledge_base()
+    get_template_ids = make_template_id_lookup(kb)
+    template_reservoirs = [Reservoir(capacity) for capacity in template_capacities(kb)]
+    direct_reservoirs = [Reservoir(SAMPLES_PER_DIRECT_PATTERN) for _ in DIRECT_QUERY_PATTERNS]
+
+    # Images per distinct tag combination, for the per-tag candidate counts in the report
+    tags_string_counts = Counter()
+
+    # 3. Single pass: offer each image to the reservoirs of its templates
+    for row in tqdm(df_merged.itertuples(index=False), total=df_merged.shape[0], desc="Sampling Text Queries"):
+        item = (row.image_url, row.dish_name)
+        tags_string_counts[row.tags] += 1
+        for reservoir in direct_reservoirs:
+            reservoir.offer(item)
+        for template_id in get_template_ids(row.tags):
+            template_reservoirs[template_id].offer(item)
+
+    final_data = []
+    reservoirs = template_reservoirs + direct_reservoirs
+    # Reservoirs are ordered like query ids: templates first, then the direct patterns
+    for query_id, reservoir in enumerate(reservoirs):
+        for image_url, dish_name in reservoir.items:
+            final_data.append({'text': query_text(kb, query_id, dish_name), 'image_url': image_url,
+                               'dish_name': dish_name, 'query_id': query_id})
+    # Reservoirs come out grouped by template; shuffle so training batches are mixed
+    random.shuffle(final_data)
+
+    df_final = pd.DataFrame(final_data)
+
+    if df_final.empty:
+        print("No data was generated. Check your file paths and column names.")
+        return
+
+    # 4. Save the dataset and the realized distribution
+    df_final[['text', 'image_url', 'dish_name']].to_csv(BALANCED_OUTPUT_DATASET_PATH, index=False)
+    report = realized_distribution(kb, template_reservoirs, direct_reservoirs, tags_string_counts)
+    report.to_csv(BALANCED_REPORT_PATH, index=False)
+
+    print(f"\nSuccessfully generated {len(df_final)} balanced (text, image_url, dish_name) pairs.")
+    print(f"Balanced training dataset saved to '{BALANCED_OUTPUT_DATASET_PATH}'")
+    print("\nRealized distribution per tag / direct pattern:")
+    print(report.to_string(index=False))
+    under_quota = report[report['sampled'] < report['quota']]
+    if not under_quota.empty:
+        print(f"\n⚠️  {len(under_quota)} tags/patterns could not fill their quota "
+              f"(e.g. '{under_quota.iloc[-1]['query_source']}'). Add keywords for them to raise coverage.")
+    print(f"Distribution report saved to '{BALANCED_REPORT_PATH}'")
+
+    if EMIT_QUERY_VOCABULARY:
+        write_query_vocabulary(df_final, kb, tokenize)
+
+
+# --- 4. QUERY VOCABULARY ---
+
+def load_default_tokenizer():
+    """
+    Returns a tokenize(text) -> list of token ids function for TOKENIZER_NAME, or None if
+    `transformers` is not installed or the tokenizer can't be loaded (offline, missing
+    `sentencepiece`, ...). Special tokens are left to the training job.
+    """
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        print("Warning: `transformers` is not installed, so the default tokenizer is unavailable.")
+        return None
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+    except (OSError, ValueError, ImportError) as e:
+        print(f"Warning: Could not load the '{TOKENIZER_NAME}' tokenizer, so the default tokenizer is unavailable. {e}")
+        return None
+    return lambda text: tokenizer.encode(text, add_special_tokens=False)
+
+
+def build_query_vocabulary(kb, tokenize):
+    """
+    Tokenizes every query template exactly once. Direct patterns are listed with empty
+    token_ids: their text depends on the dish, so their ids live in the tokenized dataset.
+    """
+    vocabulary = []
+    for template_id, template in enumerate(kb['templates']):
+        vocabulary.append({'query_id': template_id, 'kind': 'template', 'text': template,
+                           'token_ids': tokenize(template)})
+    for pattern_index, pattern in enumerate(DIRECT_QUERY_PATTERNS):
+        vocabulary.append({'query_id': direct_query_id(kb, pattern_index), 'kind': 'direct', 'text': pattern,
+                           'token_ids': []})
+    return pd.DataFrame(vocabulary)
+
+
+def write_query_vocabulary(df_final, kb, tokenize=None):
+    """
+    Writes the query vocabulary and a tokenized copy of the dataset that stores a
+    query_id per row instead of the text. A sample's token ids are
+    vocabulary.token_ids[query_id] + direct_token_ids (one of the two is always empty).
+    Direct queries are tokenized as full rendered strings, once per unique (pattern, dish_name),
+    since context-sensitive tokenizers (e.g. byte-level BPE) don't tokenize pieces the same way.
+    """
+    if tokenize is None:
+        tokenize = load_default_tokenizer()
+        if tokenize is None:
+            print("Skipping the query vocabulary. Pass `tokenize=` or make the default tokenizer loadable.")
+            return
+
+    vocabulary = build_query_vocabulary(kb, tokenize)
+    vocabulary.to_parquet(QUERY_VOCABULARY_PATH, index=False)
+
+    direct_token_ids = {}
+    is_direct = df_final['query_id'] >= len(kb['templates'])
+    for query_id, dish_name in zip(df_final.loc[is_direct, 'query_id'], df_final.loc[is_direct, 'dish_name']):
+        if (query_id, dish_name) not in direct_token_ids:
+            direct_token_ids[query_id, dish_name] = tokenize(query_text(kb, query_id, dish_name))
+
+    df_tokenized = df_final[['image_url', 'dish_name', 'query_id']].copy()
+    df_tokenized['query_id'] = df_tokenized['query_id'].astype('int32')
+    df_tokenized['direct_token_ids'] = [direct_token_ids[query_id, dish_name] if direct else []
+                                        for query_id, dish_name, direct
+                                        in zip(df_final['query_id'], df_final['dish_name'], is_direct)]
+    df_tokenized.to_parquet(TOKENIZED_DATASET_PATH, index=False)
+
+    print(f"Query vocabulary ({len(vocabulary)} entries) saved to '{QUERY_VOCABULARY_PATH}'")
+    print(f"Tokenized dataset saved to '{TOKENIZED_DATASET_PATH}'")
+
 if __name__ == '__main__':
-    generate_final_dataset()
\ No newline at end of file
+    if USE_BALANCED_SAMPLING:
+        generate_balanced_dataset()
+    else:
+        generate_final_dataset()
\ No newline at end of file
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+from thefuzz import utils
+
+# --- 1. CONFIGURATION ---
+
+# Source of truth: edit these versioned data files, never the compiled artifact.
+KEYWORD_TO_TAGS_PATH = 'data/keyword_to_tags.json'
+TAG_TO_TEMPLATES_PATH = 'data/tag_to_templates.json'
+# The compiled binary artifact shared by all scripts. It is rebuilt automatically
+# whenever the content hash of the data files no longer matches.
+ARTIFACT_PATH = 'data/knowledge_base.pkl'
+
+# Version of the data file schema this module understands.
+DATA_FILE_VERSION = 1
+# Bump this whenever the layout of the compiled artifact changes.
+ARTIFACT_FORMAT_VERSION = 1
+
+
+# --- 2. PREPROCESSING ---
+
+def preprocess_text(text):
+    """
+    Normalizes a string exactly like thefuzz does before scoring, and splits it into tokens.
+    Returns a (processed_string, token_set) pair.
+    """
+    processed = utils.full_process(str(text).lower(), force_ascii=True)
+    return processed, frozenset(processed.split())
+
+
+def tags_from_mask(kb, mask):
+    """
+    Decodes a tag bitmask into tag names. Tag ids are assigned in alphabetical
+    order, so the names come back sorted.
+    """
+    tags = kb['tags']
+    found = []
+    tag_id = 0
+    while mask:
+        if mask & 1:
+            found.append(tags[tag_id])
+        mask >>= 1
+        tag_id += 1
+    return found
+
+
+# --- 3. COMPILATION ---
+
+def read_data_file(path, key):
+    """
+    Reads the mapping stored under `key` in a versioned data file.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != DATA_FILE_VERSION:
+        raise ValueError(f"Unsupported version {data.get('version')!r} in '{path}' "
+                         f"(expected {DATA_FILE_VERSION}).")
+    return data[key]
+
+
+def write_keyword_data_file(keyword_to_tags, path=KEYWORD_TO_TAGS_PATH):
+    """
+    Writes the keyword-to-tag mapping back to its data file, one keyword per line.
+    """
+    lines = [f'        {json.dumps(keyword, ensure_ascii=False)}: {json.dumps(tags, ensure_ascii=False)}'
+             for keyword, tags in keyword_to_tags.items()]
+    text = ('{\n'
+            f'    "version": {DATA_FILE_VERSION},\n'
+            '    "keyword_to_tags": {\n'
+            + ',\n'.join(lines) +
+            '\n    }\n'
+            '}\n')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def compute_content_hash(keyword_path=KEYWORD_TO_TAGS_PATH, templates_path=TAG_TO_TEMPLATES_PATH):
+    """
+    Hashes the raw bytes of the data files together with the artifact format version.
+    """
+    digest = hashlib.sha256(f'artifact-v{ARTIFACT_FORMAT_VERSION}'.encode())
+    for path in (keyword_path, templates_path):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def compile_knowledge_base(keyword_path=KEYWORD_TO_TAGS_PATH, templates_path=TAG_TO_TEMPLATES_PATH):
+    """
+    Compiles the data files into the in-memory knowledge base:
+      - 'tags': tag names; a tag's id is its index (alphabetical order).
+      - 'keywords', 'keyword_processed', 'keyword_tokens': keywords with their
+        thefuzz-normalized form and token set, computed once here.
+      - 'keyword_tag_masks': the keyword->tag incidence matrix, one bitmask per keyword.
+      - 'templates': every unique query template; a template's id is its index.
+      - 'tag_template_ids': template ids for each tag id (empty if the tag has none).
+    """
+    keyword_to_tags = read_data_file(keyword_path, 'keyword_to_tags')
+    tag_to_templates = read_data_file(templates_path, 'tag_to_templates')
+
+    all_tags = set(tag_to_templates)
+    for tags in keyword_to_tags.values():
+        all_tags.update(tags)
+    tags = tuple(sorted(all_tags))
+    tag_ids = {tag: tag_id for tag_id, tag in enumerate(tags)}
+
+    keywords = tuple(keyword_to_tags)
+    keyword_processed = []
+    keyword_tokens = []
+    keyword_tag_masks = []
+    for keyword in keywords:
+        processed, tokens = preprocess_text(keyword)
+        keyword_processed.append(processed)
+        keyword_tokens.append(tokens)
+        mask = 0
+        for tag in keyword_to_tags[keyword]:
+            mask |= 1 << tag_ids[tag]
+        keyword_tag_masks.append(mask)
+
+    templates = []
+    template_ids = {}
+    tag_template_ids = []
+    for tag in tags:
+        ids = []
+        for template in tag_to_templates.get(tag, []):
+            if template not in template_ids:
+                template_ids[template] = len(templates)
+                templates.append(template)
+            if template_ids[template] not in ids:
+                ids.append(template_ids[template])
+        tag_template_ids.append(tuple(ids))
+
+    return {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'content_hash': compute_content_hash(keyword_path, templates_path),
+        'tags': tags,
+        'tag_ids': tag_ids,
+        'keywords': keywords,
+        'keyword_processed': tuple(keyword_processed),
+        'keyword_tokens': tuple(keyword_tokens),
+        'keyword_tag_masks': tuple(keyword_tag_masks),
+        'templates': tuple(templates),
+        'tag_template_ids': tuple(tag_template_ids),
+    }
+
+
+def write_artifact(kb, artifact_path=ARTIFACT_PATH):
+    """
+    Writes the compiled knowledge base atomically so a crash never leaves a truncated artifact.
+    """
+    tmp_path = artifact_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(kb, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, artifact_path)
+
+
+# --- 4. LOADING ---
+
+def load_knowledge_base(artifact_path=ARTIFACT_PATH,
+                        keyword_path=KEYWORD_TO_TAGS_PATH,
+                        templates_path=TAG_TO_TEMPLATES_PATH):
+    """
+    Loads the compiled knowledge base, recompiling it first if it is missing or
+    its content hash does not match the current data files.
+    """
+    content_hash = compute_content_hash(keyword_path, templates_path)
+    try:
+        with open(artifact_path, 'rb') as f:
+            kb = pickle.load(f)
+        if kb.get('format_version') == ARTIFACT_FORMAT_VERSION and kb.get('content_hash') == content_hash:
+            return kb
+    except Exception:
+        # Missing, truncated, corrupt or foreign artifact: it is only a cache, so rebuild it.
+        pass
+
+    kb = compile_knowledge_base(keyword_path, templates_path)
+    write_artifact(kb, artifact_path)
+    return kb
+
+
+if __name__ == '__main__':
+    kb = compile_knowledge_base()
+    write_artifact(kb)
+    print(f"Compiled {len(kb['keywords'])} keywords, {len(kb['tags'])} tags "
+          f"and {len(kb['templates'])} templates.")
+    print(f"Knowledge base saved to '{ARTIFACT_PATH}' (hash {kb['content_hash'][:12]})")
@@ -0,0 +1,199 @@
+import pandas as pd
+from collections import Counter
+from tqdm import tqdm
+from find_new_keywords import STOP_WORDS, TOP_N_WORDS
+from knowledge_base import (KEYWORD_TO_TAGS_PATH, load_knowledge_base, preprocess_text,
+                            read_data_file, write_keyword_data_file)
+from tag_dishes import INPUT_EXCEL_PATH, OUTPUT_EXCEL_PATH, keyword_matches
+
+# --- USAGE (e.g. from a notebook) ---
+#
+#   session = RefinementSession()             # loads and tags the corpus once
+#   session.top_unmapped_terms(20)            # what find_new_keywords.py would report
+#   session.add_keyword('schezwan', ['chinese_cuisine', 'spicy'])
+#   session.remove_keyword('pot')
+#   session.save()                            # writes dishes_with_tags_fuzzy.xlsx
+#   session.save_keywords()                   # writes data/keyword_to_tags.json
+#
+# Nothing touches the disk until save() or save_keywords() is called.
+
+
+class RefinementSession:
+    """
+    Keeps the dish corpus, its tokenized names and the keyword match state in memory,
+    so the tag/analyze loop of tag_dishes.py and find_new_keywords.py runs without
+    Excel round-trips. Every distinct dish name is preprocessed and matched only once.
+    """
+
+    def __init__(self, input_path=INPUT_EXCEL_PATH):
+        self.input_path = input_path
+        self.df = pd.read_excel(input_path)
+        if 'dish_name' not in self.df.columns:
+            raise ValueError(f"Column 'dish_name' not found in '{input_path}'.")
+
+        # Rows sharing a dish name share all of its state.
+        name_ids, names = pd.factorize(self.df['dish_name'].map(str))
+        self._row_name_ids = name_ids
+        self._names = list(names)
+        self._name_index = {name: name_id for name_id, name in enumerate(self._names)}
+        self._name_rows = pd.Series(name_ids).value_counts().reindex(range(len(names)), fill_value=0).tolist()
+        self._name_tokens = [preprocess_text(name) for name in self._names]
+        self._name_words = [[word for word in name.lower().split() if word not in STOP_WORDS]
+                            for name in self._names]
+
+        # Match state: which keywords hit each name, and which names each keyword hits.
+        self.keyword_to_tags = {}
+        self._keyword_names = {}
+        self._name_keywords = [set() for _ in self._names]
+        self._unmapped_counts = Counter()
+        for name_id in range(len(self._names)):
+            self._count_unmapped(name_id, +1)
+
+        # The compiled knowledge base already holds every keyword preprocessed.
+        kb = load_knowledge_base()
+        self._template_tags = {tag for tag, template_ids in zip(kb['tags'], kb['tag_template_ids'])
+                               if template_ids}
+        file_tags = read_data_file(KEYWORD_TO_TAGS_PATH, 'keyword_to_tags')
+        keywords = zip(kb['keywords'], kb['keyword_processed'], kb['keyword_tokens'])
+        for keyword, keyword_processed, keyword_tokens in tqdm(keywords, total=len(kb['keywords']),
+                                                               desc="Tagging Dishes (Session)"):
+            self._add(keyword, file_tags[keyword], keyword_processed, keyword_tokens)
+
+    def __repr__(self):
+        tagged, total = self.coverage()
+        return (f"<RefinementSession {len(self.keyword_to_tags)} keywords, "
+                f"{tagged}/{total} rows tagged>")
+
+    # --- Match state ---
+
+    def _is_tagged(self, name_id):
+        return any(self.keyword_to_tags[keyword] for keyword in self._name_keywords[name_id])
+
+    def _count_unmapped(self, name_id, sign):
+        rows = self._name_rows[name_id] * sign
+        for word in self._name_words[name_id]:
+            self._unmapped_counts[word] += rows
+            if self._unmapped_counts[word] == 0:
+                del self._unmapped_counts[word]
+
+    def _add(self, keyword, tags, keyword_processed, keyword_tokens):
+        self.keyword_to_tags[keyword] = list(tags)
+        matched = set()
+        newly_tagged_rows = 0
+        for name_id, (name_processed, name_tokens) in enumerate(self._name_tokens):
+            if not keyword_matches(keyword_processed, keyword_tokens, name_processed, name_tokens):
+                continue
+            matched.add(name_id)
+            was_tagged = self._is_tagged(name_id)
+            self._name_keywords[name_id].add(keyword)
+            if not was_tagged and self._is_tagged(name_id):
+                self._count_unmapped(name_id, -1)
+                newly_tagged_rows += self._name_rows[name_id]
+        self._keyword_names[keyword] = matched
+        return newly_tagged_rows
+
+    # --- Editing the keyword dictionary ---
+
+    def add_keyword(self, keyword, tags):
+        """
+        Adds a keyword (or replaces its tags) and re-tags only the dishes it matches.
+        `tags` must be a list or tuple of tag names.
+        Returns the net change in tagged rows; replacing a keyword's tags can make it negative.
+        """
+        if not isinstance(tags, (list, tuple)) or not all(isinstance(tag, str) for tag in tags):
+            raise TypeError(f"Tags must be a list or tuple of strings, got {tags!r}.")
+        unknown_tags = [tag for tag in tags if tag not in self._template_tags]
+        if unknown_tags:
+            print(f"Warning: {unknown_tags} have no query templates and will not appear in "
+                  f"generated queries. Check for typos or add them to 'data/tag_to_templates.json'.")
+
+        keyword = keyword.lower()
+        newly_untagged_rows = 0
+        if keyword in self.keyword_to_tags:
+            newly_untagged_rows = self.remove_keyword(keyword)
+        keyword_processed, keyword_tokens = preprocess_text(keyword)
+        return self._add(keyword, tags, keyword_processed, keyword_tokens) - newly_untagged_rows
+
+    def remove_keyword(self, keyword):
+        """
+        Removes a keyword and re-tags only the dishes it used to match.
+        Returns the number of rows that went from tagged to untagged.
+        """
+        keyword = keyword.lower()
+        if keyword not in self.keyword_to_tags:
+            raise KeyError(f"Keyword '{keyword}' is not in the dictionary.")
+        newly_untagged_rows = 0
+        for name_id in self._keyword_names.pop(keyword):
+            was_tagged = self._is_tagged(name_id)
+            self._name_keywords[name_id].discard(keyword)
+            if was_tagged and not self._is_tagged(name_id):
+                self._count_unmapped(name_id, +1)
+                newly_untagged_rows += self._name_rows[name_id]
+        del self.keyword_to_tags[keyword]
+        return newly_untagged_rows
+
+    # --- Analysis ---
+
+    def tags_for(self, dish_name):
+        """
+        Returns the sorted tags currently assigned to a dish name ([] if unknown or untagged).
+        """
+        name_id = self._name_index.get(str(dish_name))
+        if name_id is None:
+            return []
+        return self._tags_for_name(name_id)
+
+    def _tags_for_name(self, name_id):
+        found_tags = set()
+        for keyword in self._name_keywords[name_id]:
+            found_tags.update(self.keyword_to_tags[keyword])
+        return sorted(found_tags)
+
+    def coverage(self):
+        """
+        Returns (tagged_rows, total_rows).
+        """
+        tagged = sum(rows for name_id, rows in enumerate(self._name_rows) if self._is_tagged(name_id))
+        return tagged, len(self.df)
+
+    def top_unmapped_terms(self, n=TOP_N_WORDS):
+        """
+        Returns the n most frequent words among untagged dishes as (word, count) pairs,
+        the same ranking find_new_keywords.py prints.
+        """
+        # Counter.most_common breaks ties by first occurrence, which in the script means the
+        # first untagged row. Names are numbered by their first row, so scanning them in
+        # order reproduces that ordering.
+        first_seen = {}
+        for name_id, words in enumerate(self._name_words):
+            if not self._is_tagged(name_id):
+                for word in words:
+                    first_seen.setdefault(word, len(first_seen))
+        ranked = sorted(self._unmapped_counts.items(), key=lambda item: (-item[1], first_seen[item[0]]))
+        return ranked[:n]
+
+    # --- Persisting (only on demand) ---
+
+    def tagged_dataframe(self):
+        """
+        Returns a copy of the corpus with the current 'tags' column.
+        """
+        name_tags = ['|'.join(self._tags_for_name(name_id)) for name_id in range(len(self._names))]
+        df = self.df.copy()
+        df['tags'] = [name_tags[name_id] for name_id in self._row_name_ids]
+        return df
+
+    def save(self, output_path=OUTPUT_EXCEL_PATH):
+        """
+        Writes the tagged corpus in the same format as tag_dishes.py.
+        """
+        self.tagged_dataframe().to_excel(output_path, index=False)
+        print(f"Tagged data saved to '{output_path}'")
+
+    def save_keywords(self, keyword_path=KEYWORD_TO_TAGS_PATH):
+        """
+        Writes the edited keyword dictionary back to its data file. The compiled
+        knowledge base picks the change up automatically on its next load.
+        """
+        write_keyword_data_file(self.keyword_to_tags, keyword_path)
+        print(f"Keyword dictionary saved to '{keyword_path}'")
@@ -1,6 +1,10 @@
+import json
+import os
 import pandas as pd
+from functools import lru_cache
 from tqdm import tqdm
 from thefuzz import fuzz # <-- Import the fuzzy matching library
+from knowledge_base import load_knowledge_base, preprocess_text, tags_from_mask
 
 # --- 1. CONFIGURATION ---
 
@@ -9,186 +13,58 @@ OUTPUT_EXCEL_PATH = 'dishes_with_tags_fuzzy.xlsx'
 # We set a similarity threshold. Any match below this score will be ignored.
 # 85 is a good starting point to avoid incorrect matches.
 SIMILARITY_THRESHOLD = 65
+# Dish names repeat across rows; this many distinct names keep their tags cached.
+TAGGER_CACHE_SIZE = 100_000
 
+# --- STREAMING MODE (for inputs larger than memory) ---
+# Set to True to tag the input in fixed-size batches instead of loading it all at once.
+USE_STREAMING = False
+# Streaming accepts the Excel input or a CSV (Excel sheets stop at ~1M rows).
+STREAM_INPUT_PATH = INPUT_EXCEL_PATH
+# Rows per batch; memory use is bounded by this, not by the input size.
+STREAM_BATCH_SIZE = 50_000
+# Each tagged batch is appended here as one Parquet file (read it back with pd.read_parquet).
+STREAM_OUTPUT_DIR = 'dishes_with_tags_fuzzy_parts'
+# Written after every batch so an interrupted run resumes where it left off.
+STREAM_CHECKPOINT_PATH = os.path.join(STREAM_OUTPUT_DIR, '_checkpoint.json')
 
-# --- 2. THE "KNOWLEDGE BASE" (Your existing keyword dictionary) ---
-# --- THE "KNOWLEDGE BASE" (Keyword-to-Tag Mapping) ---
-# This expanded dictionary now covers a much wider range of dishes.
-# Keywords are lowercase for consistent matching.
-KEYWORD_TO_TAGS = {
-    # --- Curries & Gravies ---
-    'paneer': ['vegetarian', 'main_course', 'north_indian', 'creamy', 'savory', 'punjabi'],
-    'kofta': ['vegetarian', 'main_course', 'north_indian', 'creamy', 'savory', 'rich'],
-    'dal': ['vegetarian', 'main_course', 'healthy', 'comfort_food', 'curry'],
-    'daal': ['vegetarian', 'main_course', 'healthy', 'comfort_food', 'curry'],
-    'rajma': ['vegetarian', 'main_course', 'punjabi', 'healthy', 'comfort_food', 'curry'],
-    'chole': ['main_course', 'punjabi', 'savory', 'vegetarian', 'comfort_food'],
-    'curry': ['main_course', 'curry', 'savory'],
-    
-    # --- Breads ---
-    'paratha': ['bread', 'north_indian', 'breakfast', 'vegetarian'],
-    'naan': ['bread', 'north_indian', 'tandoori', 'vegetarian'],
-    'roti': ['bread', 'healthy', 'vegetarian'],
-    'chapati': ['bread', 'healthy', 'vegetarian'],
-    'kulcha': ['bread', 'punjabi', 'vegetarian'],
-
-    # --- Rice Dishes ---
-    'biryani': ['main_course', 'celebratory', 'rich', 'savory', 'rice_dish'],
-    'pulao': ['main_course', 'rice_dish', 'savory', 'light_meal'],
-    'rice': ['rice_dish'], # Generic tag for fried rice, lemon rice etc.
-
-    # --- South Indian ---
-    'dosa': ['breakfast', 'south_indian', 'savory', 'light_meal', 'vegetarian'],
-    'idli': ['breakfast', 'south_indian', 'steamed', 'healthy', 'light_meal', 'vegetarian'],
-    'vada': ['snack', 'fried', 'south_indian', 'savory'],
-    'uttapam': ['breakfast', 'south_indian', 'savory', 'vegetarian'],
-    'sambar': ['south_indian', 'curry', 'healthy', 'vegetarian'],
-
-    # --- Snacks & Street Food ---
-    'samosa': ['snack', 'fried', 'savory', 'street_food', 'rainy_day', 'vegetarian'],
-    'pakora': ['snack', 'fried', 'rainy_day', 'vegetarian'],
-    'chaat': ['street_food', 'snack', 'tangy', 'savory'],
-    'pav bhaji': ['street_food', 'main_course', 'vegetarian', 'comfort_food'],
-    'kebab': ['appetizer', 'grilled', 'tandoori', 'snack'],
-    'tikka': ['appetizer', 'grilled', 'tandoori', 'punjabi'],
-
-    # --- Desserts ---
-    'gulab jamun': ['dessert', 'sweet', 'celebratory', 'rich'],
-    'kheer': ['dessert', 'sweet', 'celebratory', 'comfort_food'],
-    'halwa': ['dessert', 'sweet', 'rich'],
-    'jalebi': ['dessert', 'sweet', 'fried', 'street_food'],
-    'barfi': ['dessert', 'sweet'],
-
-    # --- Beverages ---
-    'lassi': ['beverage', 'summer_food', 'sweet', 'healthy'],
-    'coffee': ['beverage', 'quick_and_easy'],
-    'tea': ['beverage', 'quick_and_easy', 'rainy_day'],
-    'chai': ['beverage', 'quick_and_easy', 'rainy_day'],
-    'sharbat': ['beverage', 'summer_food', 'sweet'],
-    
-    # --- Non-Vegetarian ---
-    'chicken': ['non_vegetarian'],
-    'mutton': ['non_vegetarian', 'rich'],
-    'fish': ['non_vegetarian', 'healthy'],
-    'egg': ['non_vegetarian', 'breakfast'],
-
-    # --- Core Vegetables ---
-    'aloo': ['vegetarian', 'savory'],
-    'potato': ['vegetarian', 'savory'],
-    'gobi': ['vegetarian', 'healthy'],
-    'matar': ['vegetarian'],
-    
-    # --- Common International ---
-    'noodles': ['chinese_cuisine', 'main_course', 'quick_and_easy'],
-    'manchurian': ['chinese_cuisine', 'appetizer', 'savory'],
-    'soup': ['appetizer', 'light_meal', 'healthy', 'comfort_food'],
-    'pizza': ['quick_and_easy', 'snack', 'savory'],
-    'pasta': ['main_course', 'quick_and_easy', 'savory'],
-    'salad': ['healthy', 'light_meal', 'appetizer'],
-
-    'meat': ['non_vegetarian'],
-    'beef': ['non_vegetarian', 'beef'],
-    'pork': ['non_vegetarian', 'pork'],
-    'shrimp': ['non_vegetarian', 'seafood'],
-    'seafood': ['non_vegetarian', 'seafood'],
-    
-    # --- Cooking Styles ---
-    'stir-fried': ['fried', 'chinese_cuisine'],
-    'stir-fry': ['fried', 'chinese_cuisine', 'main_course'],
-    'grilled': ['grilled', 'healthy'],
-    'braised': ['stew', 'comfort_food'],
-    'baked': ['baked'],
-    'roasted': ['baked'],
-    'stew': ['stew', 'main_course', 'comfort_food'],
-
-    # --- International Dish Types ---
-    'dumplings': ['dumpling', 'snack', 'appetizer', 'asian_cuisine', 'steamed'],
-    'sushi': ['japanese_cuisine', 'seafood', 'healthy', 'main_course'],
-    'sandwich': ['sandwich', 'snack', 'quick_and_easy', 'western_cuisine'],
-    'platter': ['platter', 'celebratory', 'appetizer'],
-    'rolls': ['appetizer', 'snack'], # Could be spring rolls, sushi rolls, etc.
-
-    # --- Desserts & Fruits ---
-    'cake': ['dessert', 'sweet', 'baked'],
-    'chocolate': ['dessert', 'sweet'],
-    'fruit': ['healthy', 'snack', 'dessert'],
-    'apple': ['healthy', 'snack', 'fruit'],
-    'watermelon': ['healthy', 'snack', 'fruit', 'summer_food'],
-    'strawberries': ['healthy', 'snack', 'fruit'],
-    'lychee': ['healthy', 'snack', 'fruit'],
-    'cream': ['dessert', 'sweet', 'creamy'],
-
-    # --- Other Key Ingredients & Types ---
-    'vegetable': ['vegetarian', 'healthy'],
-    'vegetables': ['vegetarian', 'healthy'],
-    'tofu': ['vegetarian', 'healthy', 'asian_cuisine'],
-    'hot pot': ['main_course', 'celebratory', 'asian_cuisine'],
-    'pot': ['main_course', 'celebratory', 'asian_cuisine'], # Catches "hot pot"
-    'skewers': ['snack', 'appetizer', 'grilled', 'street_food'],
-
-    'crawfish': ['non_vegetarian', 'seafood'],
-    'crab': ['non_vegetarian', 'seafood'],
-    'oysters': ['non_vegetarian', 'seafood'],
-    'lobster': ['non_vegetarian', 'seafood', 'celebratory'],
-    'salmon': ['non_vegetarian', 'seafood', 'healthy'],
-    'sashimi': ['japanese_cuisine', 'seafood', 'healthy', 'raw'],
-    'duck': ['non_vegetarian', 'rich'],
-    'steak': ['non_vegetarian', 'western_cuisine', 'main_course'],
-    'ribs': ['non_vegetarian', 'western_cuisine', 'main_course'],
-
-    # --- Western & International Dishes ---
-    'cheeseburger': ['western_cuisine', 'main_course', 'snack', 'beef', 'non_vegetarian'],
-    'hamburger': ['western_cuisine', 'main_course', 'snack', 'beef', 'non_vegetarian'],
-    'spaghetti': ['western_cuisine', 'main_course', 'pasta'],
-    'ramen': ['japanese_cuisine', 'main_course', 'soup', 'noodle'],
-    'pancakes': ['breakfast', 'sweet', 'western_cuisine'],
-    'fries': ['snack', 'fried', 'western_cuisine'],
-    'toast': ['breakfast', 'quick_and_easy', 'bread'],
-    'meatballs': ['main_course', 'savory'],
-
-    # --- Breads & Pastries ---
-    'buns': ['bread', 'steamed', 'baked'],
-    'flatbread': ['bread', 'healthy'],
-    'pastry': ['dessert', 'snack', 'baked', 'sweet'],
-    'cookies': ['dessert', 'snack', 'baked', 'sweet'],
-    
-    # --- Fruits & Vegetables ---
-    'mango': ['fruit', 'healthy', 'dessert', 'summer_food'],
-    'grapes': ['fruit', 'healthy', 'snack'],
-    'durian': ['fruit', 'dessert'],
-    'bananas': ['fruit', 'healthy', 'breakfast'],
-    'peaches': ['fruit', 'healthy', 'dessert'],
-    'cherries': ['fruit', 'healthy', 'dessert'],
-    'tomatoes': ['vegetarian', 'healthy'],
-    'corn': ['vegetarian', 'snack'],
-    'cucumber': ['vegetarian', 'healthy', 'salad'],
-    'beans': ['vegetarian', 'healthy', 'curry'],
-    'peanuts': ['snack', 'vegetarian'],
-    'nuts': ['snack', 'vegetarian', 'healthy'],
-
-    # --- Desserts & Dairy ---
-    'custard': ['dessert', 'sweet', 'creamy'],
-    'tart': ['dessert', 'sweet', 'baked'],
-    'yogurt': ['healthy', 'breakfast', 'creamy'],
-    'coconut': ['dessert', 'creamy'],
-    
-    # --- Cooking Methods & Descriptors ---
-    'stuffed': ['rich', 'savory'],
-    'boiled': ['steamed', 'healthy'],
-    'scrambled': ['breakfast', 'egg'],
-    'sautéed': ['fried', 'healthy'],
-    'cheese': ['savory', 'creamy', 'vegetarian'],
-
-    'noodle': ['noodle', 'main_course', 'asian_cuisine'],
-    'bun': ['bread', 'steamed', 'baked'],
-    'peach': ['fruit', 'healthy', 'dessert'],
-    'orange': ['fruit', 'healthy'],
-    'strawberry': ['fruit', 'healthy', 'dessert'],
-    'melon': ['fruit', 'healthy', 'summer_food'],
-    'plum': ['fruit', 'healthy'],
-    'blueberry': ['fruit', 'healthy', 'dessert'],
-    'bean': ['vegetarian', 'healthy'],
-}
+
+# --- 2. THE "KNOWLEDGE BASE" ---
+# The keyword-to-tag mapping lives in 'data/keyword_to_tags.json'.
+# It is compiled into a binary artifact by knowledge_base.py (see load_knowledge_base).
+
+
+def keyword_matches(keyword_processed, keyword_tokens, name_processed, name_tokens):
+    """
+    Returns True if a preprocessed keyword matches a preprocessed dish name.
+    Equivalent to fuzz.token_set_ratio(keyword, name) >= SIMILARITY_THRESHOLD.
+    """
+    # token_set_ratio is always 100 when one token set contains the other,
+    # so the common exact hits never reach the scorer.
+    common = keyword_tokens & name_tokens
+    if common and (common == keyword_tokens or common == name_tokens):
+        return True
+    score = fuzz.token_set_ratio(keyword_processed, name_processed, full_process=False)
+    return score >= SIMILARITY_THRESHOLD
+
+
+def make_dish_tagger(kb):
+    """
+    Builds the get_tags_for_dish(dish_name) function for a compiled knowledge base.
+    Repeated dish names are answered from a cache.
+    """
+    keywords = list(zip(kb['keyword_processed'], kb['keyword_tokens'], kb['keyword_tag_masks']))
+
+    @lru_cache(maxsize=TAGGER_CACHE_SIZE)
+    def get_tags_for_dish(dish_name):
+        name_processed, name_tokens = preprocess_text(dish_name)
+        mask = 0
+        for keyword_processed, keyword_tokens, tag_mask in keywords:
+            if keyword_matches(keyword_processed, keyword_tokens, name_processed, name_tokens):
+                mask |= tag_mask
+        return '|'.join(tags_from_mask(kb, mask))
+
+    return get_tags_for_dish
 
 
 def automate_tagging_fuzzy():
@@ -206,22 +82,7 @@ def automate_tagging_fuzzy():
         return
 
     tqdm.pandas(desc="Tagging Dishes (Fuzzy Search)")
-
-    # --- THIS IS THE MODIFIED FUNCTION ---
-    def get_tags_for_dish(dish_name):
-        found_tags = set()
-        name_lower = str(dish_name).lower()
-        
-        for keyword, tags in KEYWORD_TO_TAGS.items():
-            # Calculate the similarity score between the keyword and the dish name
-            # partial_ratio is good for finding a short keyword within a longer dish name
-            score = fuzz.token_set_ratio(keyword, name_lower)
-            
-            # If the score is above our threshold, we consider it a match
-            if score >= SIMILARITY_THRESHOLD:
-                found_tags.update(tags)
-        
-        return '|'.join(sorted(list(found_tags)))
+    get_tags_for_dish = make_dish_tagger(load_knowledge_base())
 
     # Apply the new fuzzy function to create the 'tags' column
     df['tags'] = df['dish_name'].progress_apply(get_tags_for_dish)
@@ -232,14 +93,171 @@ def automate_tagging_fuzzy():
     # Report on untagged dishes
     untagged_count = df[df['tags'] == ''].shape[0]
     total_count = len(df)
-    
+    report_untagged(untagged_count, total_count, OUTPUT_EXCEL_PATH)
+
+
+def report_untagged(untagged_count, total_count, output_path):
+    """
+    Prints the end-of-run summary shared by the in-memory and streaming modes.
+    """
     print(f"\nSuccessfully processed {total_count} dishes.")
-    print(f"Tagged data saved to '{OUTPUT_EXCEL_PATH}'")
+    print(f"Tagged data saved to '{output_path}'")
     if untagged_count > 0:
         print(f"⚠️  {untagged_count} out of {total_count} dishes remain untagged.")
         print("Consider adding more keywords for them or lowering the SIMILARITY_THRESHOLD.")
     else:
         print("✅ All dishes were successfully tagged!")
 
+
+# --- 3. STREAMING MODE ---
+
+def iter_input_batches(input_path, batch_size, skip_rows=0):
+    """
+    Yields the input as DataFrames of at most batch_size rows, skipping the first skip_rows data rows.
+    CSV files are read with pandas' chunked reader, Excel files with openpyxl's read-only mode.
+    Every value is read as a string (empty cells stay missing) so all batches share one schema.
+    """
+    if input_path.lower().endswith('.csv'):
+        # A callable keeps skiprows from materializing millions of row numbers.
+        reader = pd.read_csv(input_path, chunksize=batch_size, dtype=str,
+                             skiprows=lambda i: 0 < i <= skip_rows)
+        for batch in reader:
+            yield batch
+        return
+
+    # Streaming-only dependency, imported here so the in-memory mode doesn't need it.
+    from openpyxl import load_workbook
+    workbook = load_workbook(input_path, read_only=True)
+    try:
+        # The first sheet, like pd.read_excel in the in-memory mode (not the active one).
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        # Blank header cells get pandas' names, so both modes produce the same columns.
+        columns = [f'Unnamed: {i}' if column is None else str(column) for i, column in enumerate(header)]
+        for _ in range(skip_rows):
+            if next(rows, None) is None:
+                return
+        batch = []
+        for row in rows:
+            # Pad or trim rows to the header width; stray cells past the header are dropped.
+            row = (list(row) + [None] * len(columns))[:len(columns)]
+            batch.append([None if value is None else str(value) for value in row])
+            if len(batch) == batch_size:
+                yield pd.DataFrame(batch, columns=columns)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _input_fingerprint(input_path, kb):
+    """
+    Identifies one tagging job. A checkpoint is only resumed if all of these still match.
+    """
+    stat = os.stat(input_path)
+    return {
+        'input_path': os.path.abspath(input_path),
+        'input_size': stat.st_size,
+        'input_mtime': stat.st_mtime,
+        'knowledge_base_hash': kb['content_hash'],
+        'similarity_threshold': SIMILARITY_THRESHOLD,
+        'batch_size': STREAM_BATCH_SIZE,
+        # Parts written before the shared all-string schema can't be mixed with new ones.
+        'part_schema': 'all-string',
+    }
+
+
+def _load_checkpoint(fingerprint):
+    try:
+        with open(STREAM_CHECKPOINT_PATH, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if checkpoint.get('fingerprint') != fingerprint:
+        print("Existing checkpoint belongs to a different input or knowledge base. Starting over.")
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint):
+    # Write-then-rename, so a crash mid-write never corrupts the previous checkpoint.
+    tmp_path = STREAM_CHECKPOINT_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, STREAM_CHECKPOINT_PATH)
+
+
+def _part_schema(columns):
+    """
+    The schema shared by every part file: all input columns plus 'tags' as strings.
+    Without it, a column that is empty in one batch would be written with a different type.
+    """
+    import pyarrow as pa  # Streaming-only dependency
+    return pa.schema([(str(column), pa.string()) for column in columns])
+
+
+def _part_path(batch_index):
+    return os.path.join(STREAM_OUTPUT_DIR, f'part-{batch_index:05d}.parquet')
+
+
+def automate_tagging_streaming():
+    """
+    Tags the input in batches of STREAM_BATCH_SIZE rows, appending each tagged batch
+    to STREAM_OUTPUT_DIR as a Parquet file and checkpointing after every batch.
+    Re-running after an interruption resumes from the last completed batch.
+    """
+    if not os.path.exists(STREAM_INPUT_PATH):
+        print(f"FATAL: Input file not found at '{STREAM_INPUT_PATH}'.")
+        return
+
+    kb = load_knowledge_base()
+    get_tags_for_dish = make_dish_tagger(kb)
+    fingerprint = _input_fingerprint(STREAM_INPUT_PATH, kb)
+    os.makedirs(STREAM_OUTPUT_DIR, exist_ok=True)
+
+    checkpoint = _load_checkpoint(fingerprint)
+    if checkpoint is None:
+        # Drop parts left over from an unrelated run so they don't mix with this one.
+        for name in os.listdir(STREAM_OUTPUT_DIR):
+            if name.startswith('part-') and name.endswith('.parquet'):
+                os.remove(os.path.join(STREAM_OUTPUT_DIR, name))
+        checkpoint = {'fingerprint': fingerprint, 'batches_done': 0, 'rows_done': 0,
+                      'untagged_rows': 0, 'complete': False}
+    elif checkpoint['complete']:
+        print("This input was already fully tagged.")
+        report_untagged(checkpoint['untagged_rows'], checkpoint['rows_done'], STREAM_OUTPUT_DIR)
+        return
+    else:
+        print(f"Resuming after {checkpoint['rows_done']} rows ({checkpoint['batches_done']} batches).")
+
+    batches = iter_input_batches(STREAM_INPUT_PATH, STREAM_BATCH_SIZE, skip_rows=checkpoint['rows_done'])
+    with tqdm(desc="Tagging Dishes (Streaming)", unit='rows', initial=checkpoint['rows_done']) as progress:
+        for batch in batches:
+            if 'dish_name' not in batch.columns:
+                print(f"FATAL: Column 'dish_name' not found in the input file.")
+                return
+
+            batch['tags'] = batch['dish_name'].map(get_tags_for_dish)
+            # Parts past the checkpoint are leftovers from an interrupted batch; overwrite them.
+            batch.to_parquet(_part_path(checkpoint['batches_done']), index=False,
+                             schema=_part_schema(batch.columns))
+
+            checkpoint['batches_done'] += 1
+            checkpoint['rows_done'] += len(batch)
+            checkpoint['untagged_rows'] += int((batch['tags'] == '').sum())
+            _save_checkpoint(checkpoint)
+            progress.update(len(batch))
+
+    checkpoint['complete'] = True
+    _save_checkpoint(checkpoint)
+    report_untagged(checkpoint['untagged_rows'], checkpoint['rows_done'], STREAM_OUTPUT_DIR)
+
+
 if __name__ == '__main__':
-    automate_tagging_fuzzy()
\ No newline at end of file
+    if USE_STREAMING:
+        automate_tagging_streaming()
+    else:
+        automate_tagging_fuzzy()
\ No newline at end of file